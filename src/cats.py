@@ -1,32 +1,81 @@
-from dataclasses import dataclass
-from .utils import contains, split
+from dataclasses import dataclass, field
+
+OPERATORS = ('|+', '-', '&', ',')
+BRACKETS = {'(': ')', '[': ']', '{': '}'}
+
+def tokenize(string: str) -> tuple[str, list[str]]:
+    """Nesting-aware split on the loosest-binding category operator, in a single pass."""
+
+    positions = {operators: [] for operators in OPERATORS}
+    opened = []
+    index = 0
+    while index < len(string):
+        char = string[index]
+        if char == '\\':
+            index += 2
+            continue
+        elif char in BRACKETS:
+            opened.append(index)
+        elif char in ')]}':
+            if not opened:
+                raise ValueError(f'{char!r} at {index} does not have an opening bracket')
+            start = opened.pop()
+            if BRACKETS[string[start]] != char:
+                raise ValueError(f'{char!r} at {index} does not match {string[start]!r} at {start}')
+        elif not opened:
+            for operators in OPERATORS:
+                if char in operators:
+                    positions[operators].append(index)
+        index += 1
+    if opened:
+        raise ValueError(f'{string[opened[-1]]!r} at {opened[-1]} does not have a closing bracket')
+    for operators in OPERATORS:
+        if positions[operators]:
+            bounds = [-1, *positions[operators], len(string)]
+            return operators, [string[start+1:stop] for start, stop in zip(bounds, bounds[1:])]
+    return '', [string]
 
 @dataclass
 class Category:
     elements: list[str]
     name: str | None = None
+    members: frozenset[str] = field(init=False, repr=False, compare=False)
+    indices: dict[str, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.members = frozenset(self.elements)
+        self.indices = {}
+        for i, element in enumerate(self.elements):
+            self.indices.setdefault(element, i)
 
     @staticmethod
     def parse(string: str, categories: 'dict[str, Category]') -> 'Category':
-        if contains(string, '|', '+'):
+        operators, items = tokenize(string)
+        if operators == '|+':
             elements = []
-            for item in split(string, '|', '+'):
+            for item in items:
                 elements.extend(Category.parse(item, categories).elements)
             return Category(elements)
-        elif contains(string, '-'):
-            items = split(string, '-')
+        elif operators == '-':
             elements = Category.parse(items.pop(0), categories).elements
             for item in items:
-                elements = [element for element in elements if element not in Category.parse(item, categories)]
+                # Operands are only parsed while there are elements left to filter
+                if not elements:
+                    break
+                category = Category.parse(item, categories)
+                elements = [element for element in elements if element not in category]
             return Category(elements)
-        elif contains(string, '&'):
-            items = split(string, '&')
+        elif operators == '&':
             elements = Category.parse(items.pop(0), categories).elements
             for item in items:
-                elements = [element for element in elements if element in Category.parse(item, categories)]
+                # Operands are only parsed while there are elements left to filter
+                if not elements:
+                    break
+                category = Category.parse(item, categories)
+                elements = [element for element in elements if element in category]
             return Category(elements)
-        elif contains(string, ','):
-            return Category(list(filter(None, split(string, ','))))
+        elif operators == ',':
+            return Category(list(filter(None, items)))
         else:
             return categories[string]
 
@@ -40,10 +89,9 @@ class Category:
         return self.elements[item]
 
     def __contains__(self, item: str) -> bool:
-        return item in self.elements
+        return item in self.members
 
     def index(self, item: str) -> int:
-        for i, element in enumerate(self.elements):
-            if element == item:
-                return i
+        if item in self.indices:
+            return self.indices[item]
         raise ValueError(f'{item!r} is not in category')
@@ -1,6 +1,6 @@
+import atexit
 import sys
-from contextlib import nullcontext
-from datetime import datetime
+import time
 from pathlib import Path
 
 LEVELS = {
@@ -13,28 +13,49 @@ CONSOLE = sys.stdout
 
 file = CONSOLE
 level = 'INFO'
+_handle = None
 
 def _open(file):
+    global _handle
+    if _handle is not None and _handle[0] != file:
+        close()
     if file is CONSOLE:
-        return nullcontext(file)
-    else:
-        return file.open(mode='a')
+        return file
+    if _handle is None:
+        _handle = file, file.open(mode='a', buffering=1)
+    return _handle[1]
+
+
+def close() -> None:
+    global _handle
+    if _handle is not None:
+        _handle[1].close()
+        _handle = None
+
+atexit.register(close)
+
+
+def enabled(level_: str) -> bool:
+    return LEVELS[level_] <= LEVELS[level]
 
 
 def _log(level_: str, *message: str, **kwargs) -> None:
-    if LEVELS[level_] > LEVELS[level]:
+    if not enabled(level_):
         return
-    timestamp = datetime.now().isoformat(sep=' ', timespec='seconds')
-    with _open(file) as f:
-        print(timestamp, f'[{level_}]: ', end='', file=f)
-        print(*message, file=f, **kwargs)
+    f = _open(file)
+    print(time.strftime('%Y-%m-%d %H:%M:%S'), f'[{level_}]: ', end='', file=f)
+    print(*message, file=f, **kwargs)
+
 
+_funcs = {}
 
 def __getattr__(name: str):
-    level = name.upper()
-    if level not in LEVELS:
-        raise AttributeError
-    def func(*message: str, **kwargs):
-        _log(level, *message, **kwargs)
-    func.__name__ = name
-    return func
+    if name not in _funcs:
+        level = name.upper()
+        if level not in LEVELS:
+            raise AttributeError
+        def func(*message: str, **kwargs):
+            _log(level, *message, **kwargs)
+        func.__name__ = name
+        _funcs[name] = func
+    return _funcs[name]
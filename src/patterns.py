@@ -1,11 +1,24 @@
 import re
-from dataclasses import dataclass
-from typing import overload
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, overload
 from . import cats, words
 from .utils import match_bracket
 from .words import Word
 
 ESCAPES = '+-,>/!()[]{}?*"\\$%<'
+SUBSCRIPT = re.compile('[₀₁₂₃₄₅₆₇₈₉]+')
+TO_SUBSCRIPT = str.maketrans('0123456789', '₀₁₂₃₄₅₆₇₈₉')
+FROM_SUBSCRIPT = str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')
+
+# Opcodes
+CHAR, CAT, WILD, PREV, BIND, SUB, REP, LIT, JUMP, SPLIT, MATCH = range(11)
+FAIL = -1
+MAX_RESOLVED = 256
+MAX_PATTERNS = 4096
+
+# Element kinds, numbered so that single-phone kinds (up to WILDCARD), branching kinds (WILDCARD to
+# WILDCARD_REP) and subpattern kinds (OPTIONAL to WILDCARD_REP) are each contiguous
+GRAPHEME, DITTO, CATEGORY, WILDCARD, OPTIONAL, REPETITION, WILDCARD_REP, TARGETREF, SYLBREAK, COMPARISON, OTHER = range(11)
 
 class MatchFailed(Exception):
     pass
@@ -44,38 +57,65 @@ def get_index(word: Word, start: int|None=None, stop: int|None=None) -> int:
         raise MatchFailed()
 
 
-def Match(start: int, stop: int) -> slice:
-    return slice(start, stop)
+def get_phones(word: Word) -> list[str]:
+    # Index the underlying list directly to skip Word.__getitem__ in the matching loops
+    return word.phones if isinstance(word, Word) else word
+
 
+# Matches are plain slices; aliasing the type avoids a Python-level call per match
+Match = slice
 
-@dataclass
+
+@dataclass(slots=True)
 class Element:
+    KIND = OTHER
+
     def __str__(self) -> str:
         return ''
 
     def __repr__(self) -> str:
         return f'{self.__class__.__name__}({str(self)!r})'
 
-    def match(self, word: Word, start: int|None=None, stop: int|None=None) -> tuple[int, dict[int, int]]:
+    def match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
         if (start is None) == (stop is None):
             raise TypeError('exactly one of start and stop must be given.')
-        else:
-            raise MatchFailed()
+        elif start is not None:
+            return self.match_forward(word, start, catixes)
+        else:  # stop is not None
+            return self.match_backward(word, stop, catixes)
+
+    def match_forward(self, word: Word, start: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        raise MatchFailed()
+
+    def match_backward(self, word: Word, stop: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        raise MatchFailed()
 
 class CharacterMixin:
+    __slots__ = ()
+
     def _match(self, word: Word, index: int) -> bool:
         return False
 
-    def match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
-        index = get_index(word, start=start, stop=stop)
-        if self._match(word, index):
+    def match_forward(self, word: Word, start: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        if 0 <= start < len(word) and self._match(word, start):
+            return 1, catixes
+        else:
+            raise MatchFailed()
+
+    def match_backward(self, word: Word, stop: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        if 0 < stop <= len(word) and self._match(word, stop-1):
             return 1, catixes
         else:
             raise MatchFailed()
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class Grapheme(CharacterMixin, Element):
+    KIND = GRAPHEME
     grapheme: str
 
     def __str__(self) -> str:
@@ -88,8 +128,19 @@ class Grapheme(CharacterMixin, Element):
         return word[index] == self.grapheme
 
 
-@dataclass(repr=False)
+# Graphemes are never mutated, so one instance per phone can be shared between patterns
+_graphemes: dict[str, Grapheme] = {}
+
+def get_grapheme(phone: str) -> Grapheme:
+    if phone not in _graphemes:
+        _graphemes[phone] = Grapheme(phone)
+    return _graphemes[phone]
+
+
+@dataclass(repr=False, slots=True)
 class Ditto(CharacterMixin, Element):
+    KIND = DITTO
+
     def __str__(self) -> str:
         return '"'
 
@@ -100,38 +151,58 @@ class Ditto(CharacterMixin, Element):
         return index and word[index] == word[index-1]
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class Category(Element):
+    KIND = CATEGORY
     category: cats.Category
     subscript: int | None
 
     def __str__(self) -> str:
         string = f'[{self.category}]'
         if self.subscript is not None:
-            string += str(self.subscript).translate(str.maketrans('0123456789', '₀₁₂₃₄₅₆₇₈₉'))
+            string += str(self.subscript).translate(TO_SUBSCRIPT)
         return string
 
-    def match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
-        index = get_index(word, start=start, stop=stop)
+    def match_forward(self, word: Word, start: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        if 0 <= start < len(word):
+            return self._match_index(word, start, catixes)
+        else:
+            raise MatchFailed()
+
+    def match_backward(self, word: Word, stop: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        if 0 < stop <= len(word):
+            return self._match_index(word, stop-1, catixes)
+        else:
+            raise MatchFailed()
+
+    def _match_index(self, word: Word, index: int, catixes: dict[int, int]) -> tuple[int, dict[int, int]]:
         # Note that this will change if sequences become supported in categories
+        phone = word[index]
         if self.subscript is None:
-            if word[index] in self.category:
+            if phone in self.category.members:
                 return 1, catixes
         elif self.subscript in catixes:
-            if word[index] == self.category[catixes[self.subscript]]:
+            if phone == self.category.elements[catixes[self.subscript]]:
                 return 1, catixes
         else:
-            if word[index] in self.category:
-                return 1, catixes | {self.subscript: self.category.index(word[index])}
+            if phone in self.category.indices:
+                return 1, catixes | {self.subscript: self.category.indices[phone]}
 
         raise MatchFailed()
 
 
 @dataclass(repr=False)
 class BranchMixin:
+    __slots__ = ()
     greedy: bool
 
-    def match_pattern(self, pattern: 'Pattern', word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
+    def match_pattern(self, pattern: 'Pattern', word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
         if self.greedy:
             try:
                 return self._match_branch(pattern, word, start, stop, catixes)
@@ -146,17 +217,47 @@ class BranchMixin:
 
 @dataclass(repr=False)
 class WildcardMixin(BranchMixin):
-    def _match_branch(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
-        return self.match_pattern(pattern, word, start, stop, catixes)
+    __slots__ = ()
 
-    def match_pattern(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
+    def match_pattern(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        # Iterative form of BranchMixin's branching, so that long runs don't recurse once per repetition
         length, catixes = self.match(word, start, stop, catixes)
-        _length, catixes = super().match_pattern(pattern, word, *advance(word, length, start, stop), catixes)
-        return length + _length, catixes
+        if self.greedy:
+            branches = [(length, catixes)]
+            while True:
+                try:
+                    _length, catixes = self.match(word, *advance(word, length, start, stop), catixes)
+                except MatchFailed:
+                    break
+                if not _length:
+                    break
+                length += _length
+                branches.append((length, catixes))
+            for length, catixes in reversed(branches):
+                try:
+                    _length, catixes = pattern._match(word, *advance(word, length, start, stop), catixes)
+                    return length + _length, catixes
+                except MatchFailed:
+                    pass
+            raise MatchFailed()
+        else:
+            while True:
+                try:
+                    _length, _catixes = pattern._match(word, *advance(word, length, start, stop), catixes)
+                    return length + _length, _catixes
+                except MatchFailed:
+                    pass
+                _length, catixes = self.match(word, *advance(word, length, start, stop), catixes)
+                if not _length:
+                    raise MatchFailed()
+                length += _length
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class Wildcard(WildcardMixin, CharacterMixin, Element):
+    KIND = WILDCARD
     extended: bool
 
     def __str__(self) -> str:
@@ -168,20 +269,31 @@ class Wildcard(WildcardMixin, CharacterMixin, Element):
 
 @dataclass(repr=False)
 class SubpatternMixin:
+    __slots__ = ()
     pattern: 'Pattern'
 
-    def match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
-        return self.pattern._match(word, start=start, stop=stop, catixes=catixes)
+    def match_forward(self, word: Word, start: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        return self.pattern._match(word, start=start, catixes=catixes)
 
+    def match_backward(self, word: Word, stop: int, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        return self.pattern._match(word, stop=stop, catixes=catixes)
 
-@dataclass(repr=False)
+
+@dataclass(repr=False, slots=True)
 class Repetition(SubpatternMixin, Element):
+    KIND = REPETITION
     number: int
 
     def __str__(self) -> str:
         return f'({self.pattern}){{{self.number}}}'
 
-    def match_pattern(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
+    def match_pattern(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
         length = 0
         for _ in range(self.number):
             _length, catixes = self.match(word, *advance(word, length, start, stop), catixes=catixes)
@@ -190,31 +302,40 @@ class Repetition(SubpatternMixin, Element):
         return length + _length, catixes
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class WildcardRepetition(WildcardMixin, SubpatternMixin, Element):
+    KIND = WILDCARD_REP
+
     def __str__(self) -> str:
         return f'({self.pattern})' + ('{*}' if self.greedy else '{*?}')
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class Optional(BranchMixin, SubpatternMixin, Element):
+    KIND = OPTIONAL
+
     def __str__(self) -> str:
         return f'({self.pattern})' + ('' if self.greedy else '?')
 
-    def _match_branch(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
+    def _match_branch(self, pattern: 'Pattern', word: Word, start:int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
         length, catixes = self.match(word, start, stop, catixes)
         _length, catixes = pattern._match(word, *advance(word, length, start, stop), catixes)
         return length + _length, catixes
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class SylBreak(Element):
+    KIND = SYLBREAK
+
     def __str__(self) -> str:
         return '$'
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class Comparison(Element):
+    KIND = COMPARISON
     operation: str
     value: int
     pattern: 'Pattern'
@@ -223,20 +344,385 @@ class Comparison(Element):
         return f'{{{self.operation}{self.value}}}'.replace('==', '=')
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class TargetRef(Element):
+    KIND = TARGETREF
     direction: int
 
     def __str__(self) -> str:
         return '%' if self.direction == 1 else '<'
 
 
-@dataclass
+@dataclass(slots=True)
+class DFA:
+    steps: list[tuple[int, str | frozenset[str]]]
+    states: dict[frozenset[int], int] = field(init=False, repr=False, default_factory=dict)
+    positions: list[frozenset[int]] = field(init=False, repr=False, default_factory=list)
+    table: list[dict[str, int]] = field(init=False, repr=False, default_factory=list)
+    accepting: list[bool] = field(init=False, repr=False, default_factory=list)
+
+    def __post_init__(self) -> None:
+        self._state(frozenset([0]))
+
+    def _state(self, positions: frozenset[int]) -> int:
+        if positions not in self.states:
+            self.states[positions] = len(self.table)
+            self.positions.append(positions)
+            self.table.append({})
+            self.accepting.append(len(self.steps) in positions)
+        return self.states[positions]
+
+    def _transition(self, state: int, phone: str) -> int:
+        positions = {0}  # A new match may begin at every phone
+        for i in self.positions[state]:
+            if i < len(self.steps):
+                op, arg = self.steps[i]
+                if phone == arg if op == CHAR else phone in arg:
+                    positions.add(i+1)
+        self.table[state][phone] = next = self._state(frozenset(positions))
+        return next
+
+    def search(self, word: Word, start: int, stop: int) -> list[int]:
+        length = len(self.steps)
+        table, accepting = self.table, self.accepting
+        starts = []
+        state = 0
+        for index in range(start, min(len(word), stop + length - 1)):
+            phone = word[index]
+            next = table[state].get(phone)
+            if next is None:
+                next = self._transition(state, phone)
+            state = next
+            if accepting[state]:
+                starts.append(index + 1 - length)
+        return starts
+
+
+@dataclass(slots=True)
+class Program:
+    ops: bytes
+    args: list
+    reverse: bool = False
+    binds: bool = False
+    minlength: int = 0
+    dfa: DFA | None = None
+    prefix: list[str] = field(default_factory=list)
+    first: frozenset[str] | None = None
+    fast: Callable[[Word, int], int] | None = None
+
+    @staticmethod
+    def compile(elements: list[Element], reverse: bool=False) -> 'Program | None':
+        ops = bytearray()
+        args = []
+
+        def emit(op: int, arg=0) -> int:
+            ops.append(op)
+            args.append(arg)
+            return len(ops) - 1
+
+        minlength = 0
+        for element in (reversed(elements) if reverse else elements):
+            kind = element.KIND
+            if kind <= WILDCARD:
+                minlength += 1
+            if kind == GRAPHEME:
+                emit(CHAR, element.grapheme)
+            elif kind == DITTO:
+                emit(PREV)
+            elif kind == CATEGORY:
+                if element.subscript is None:
+                    emit(CAT, element.category.members)
+                else:
+                    emit(BIND, (element.category.elements, element.category.indices, element.subscript))
+            elif kind == WILDCARD:
+                loop = emit(WILD, int(element.extended))
+                if element.greedy:
+                    split = emit(SPLIT)
+                    emit(JUMP, loop)
+                    args[split] = len(ops)
+                else:
+                    emit(SPLIT, loop)
+            elif OPTIONAL <= kind <= WILDCARD_REP:
+                sub = element.pattern.compile(reverse)
+                if sub is None:
+                    return None
+                if kind == REPETITION:
+                    minlength += element.number * sub.minlength
+                    for _ in range(element.number):
+                        emit(SUB, sub)
+                elif kind == WILDCARD_REP:
+                    minlength += sub.minlength
+                    # Further iterations must consume something, or they would loop forever
+                    emit(SUB, sub)
+                    loop = emit(SPLIT)
+                    if element.greedy:
+                        emit(REP, sub)
+                        emit(JUMP, loop)
+                        args[loop] = len(ops)
+                    else:
+                        jump = emit(JUMP)
+                        args[loop] = emit(REP, sub)
+                        emit(JUMP, loop)
+                        args[jump] = len(ops)
+                elif element.greedy:
+                    split = emit(SPLIT)
+                    emit(SUB, sub)
+                    args[split] = len(ops)
+                else:
+                    split = emit(SPLIT)
+                    jump = emit(JUMP)
+                    args[split] = emit(SUB, sub)
+                    args[jump] = len(ops)
+            else:
+                return None
+        emit(MATCH)
+        binds = BIND in ops or any(arg.binds for arg in args if isinstance(arg, Program))
+        # Fixed-length patterns of plain phones and categories can be searched for with a DFA
+        # and matched at a single position with generated code
+        if len(ops) > 1 and all(op == CHAR or op == CAT for op in ops[:-1]):
+            dfa = None if reverse else DFA(list(zip(ops[:-1], args)))
+            fast = Program.codegen(ops[:-1], args[:-1], reverse)
+        else:
+            dfa = fast = None
+        # Leading literal phones let matchall skip straight to the positions where they occur,
+        # and the set of phones a match can start with lets it skip positions that can't start one
+        prefix = []
+        first = None
+        if not reverse:
+            for op, arg in zip(ops, args):
+                if op != CHAR:
+                    break
+                prefix.append(arg)
+            first = Program.first_phones(ops, args)
+        if fast is None:
+            ops, args = Program.coalesce(ops, args, reverse)
+        return Program(bytes(ops), args, reverse, binds, minlength, dfa, prefix, first, fast)
+
+    @staticmethod
+    def first_phones(ops: bytearray, args: list) -> frozenset[str] | None:
+        # None if a match could start with any phone, or be empty
+        phones = set()
+        stack = [0]
+        seen = set()
+        while stack:
+            pc = stack.pop()
+            if pc in seen:
+                continue
+            seen.add(pc)
+            op, arg = ops[pc], args[pc]
+            if op == CHAR:
+                phones.add(arg)
+            elif op == CAT:
+                phones |= arg
+            elif op == BIND:
+                phones |= arg[1].keys()
+            elif op == SUB or op == REP:
+                if arg.first is None:
+                    return None
+                phones |= arg.first
+            elif op == JUMP:
+                stack.append(arg)
+            elif op == SPLIT:
+                stack.extend((pc+1, arg))
+            else:  # WILD, PREV and MATCH
+                return None
+        return frozenset(phones)
+
+    @staticmethod
+    def coalesce(ops: bytearray, args: list, reverse: bool=False) -> tuple[bytearray, list]:
+        # Runs of literal phones become a single LIT instruction comparing a slice of the word
+        targets = {arg for op, arg in zip(ops, args) if op == JUMP or op == SPLIT}
+        _ops = bytearray()
+        _args = []
+        remap = []
+        for pc, (op, arg) in enumerate(zip(ops, args)):
+            remap.append(len(_ops))
+            if op == CHAR and pc not in targets and _ops and (_ops[-1] == CHAR or _ops[-1] == LIT):
+                if _ops[-1] == CHAR:
+                    _ops[-1] = LIT
+                    _args[-1] = [_args[-1]]
+                if reverse:
+                    _args[-1].insert(0, arg)
+                else:
+                    _args[-1].append(arg)
+            else:
+                _ops.append(op)
+                _args.append(arg)
+        for pc, op in enumerate(_ops):
+            if op == JUMP or op == SPLIT:
+                _args[pc] = remap[_args[pc]]
+        return _ops, _args
+
+    @staticmethod
+    def codegen(ops: bytes, args: list, reverse: bool=False) -> Callable[[Word, int], int]:
+        length = len(ops)
+        tests = []
+        params = ''
+        for i, (op, arg) in enumerate(zip(ops, args)):
+            index = f'pos-{i+1}' if reverse else f'pos+{i}'
+            if op == CHAR:
+                tests.append(f'word[{index}] == {arg!r}')
+            else:  # op == CAT
+                tests.append(f'word[{index}] in cat{i}')
+                params += f', cat{i}=cat{i}'
+        if reverse:
+            bounds, end = f'{length} <= pos <= len(word)', f'pos-{length}'
+        else:
+            bounds, end = f'0 <= pos <= len(word)-{length}', f'pos+{length}'
+        source = (
+            f'def match(word, pos{params}):\n'
+            f'    if {bounds} and {" and ".join(tests)}:\n'
+            f'        return {end}\n'
+            f'    return {FAIL}\n'
+        )
+        namespace = {f'cat{i}': arg for i, (op, arg) in enumerate(zip(ops, args)) if op == CAT}
+        exec(source, namespace)
+        return namespace['match']
+
+    def candidates(self, word: Word, start: int, stop: int) -> Iterator[int]:
+        first, length = self.prefix[0], len(self.prefix)
+        index = start
+        while index < stop:
+            try:
+                index = word.index(first, index, stop)
+            except ValueError:
+                return
+            if length == 1 or word[index:index+length] == self.prefix:
+                yield index
+            index += 1
+
+    def memo(self) -> dict[int, bytearray | None] | None:
+        # Failed (pc, pos) states can only be skipped when category indices can't change the outcome
+        if self.binds:
+            return None
+        else:
+            return {}
+
+    def exec(self, word: Word, pos: int, catixes: dict[int, int]|None=None, memo: dict[int, bytearray | None] | None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
+        if self.fast is not None:
+            return self.fast(word, pos), catixes
+        ops, args = self.ops, self.args
+        step, offset = (-1, -1) if self.reverse else (1, 0)
+        length = len(word)
+        width = length + 1
+        # Each program in the tree keeps its own visited states, since subprograms are atomic and
+        # so fail from a given state however they were entered
+        if memo is None:
+            visited = None
+        elif id(self) in memo:
+            visited = memo[id(self)]
+        else:
+            visited = memo[id(self)] = bytearray(len(ops) * width) if SPLIT in ops else None
+        choicepoints = []
+        dirty = []
+        pc = 0
+        while True:
+            op = ops[pc]
+            arg = args[pc]
+            if op < SUB:  # Instructions that consume a phone
+                index = pos + offset
+                if not 0 <= index < length:
+                    matched = False
+                else:
+                    phone = word[index]
+                    if op == CHAR:
+                        matched = phone == arg
+                    elif op == CAT:
+                        matched = phone in arg
+                    elif op == WILD:
+                        matched = arg or phone != '#'
+                    elif op == PREV:
+                        matched = index and phone == word[index-1]
+                    else:  # op == BIND
+                        elements, indices, subscript = arg
+                        if subscript in catixes:
+                            matched = phone == elements[catixes[subscript]]
+                        elif phone in indices:
+                            catixes = catixes | {subscript: indices[phone]}
+                            matched = True
+                        else:
+                            matched = False
+                    if matched:
+                        pos += step
+            elif op == JUMP:
+                pc = arg
+                continue
+            elif op == SPLIT:
+                if visited is None:
+                    matched = True
+                else:
+                    state = pc * width + pos
+                    matched = not visited[state]
+                    if matched:
+                        visited[state] = 1
+                        dirty.append(state)
+                if matched:
+                    choicepoints.append((arg, pos, catixes))
+            elif op == MATCH:
+                # States on the successful path haven't failed, so they can't stay marked
+                for state in dirty:
+                    visited[state] = 0
+                return pos, catixes
+            elif op == LIT:
+                if step == 1:
+                    end = pos + len(arg)
+                    matched = end <= length and word[pos:end] == arg
+                else:
+                    end = pos - len(arg)
+                    matched = end >= 0 and word[end:pos] == arg
+                if matched:
+                    pos = end
+            else:  # op == SUB or op == REP
+                end, _catixes = arg.exec(word, pos, catixes, memo)
+                matched = end != FAIL and (op == SUB or end != pos)
+                if matched:
+                    pos, catixes = end, _catixes
+
+            if matched:
+                pc += 1
+            elif choicepoints:
+                pc, pos, catixes = choicepoints.pop()
+            else:
+                return FAIL, catixes
+
+
+@dataclass(slots=True)
 class Pattern:
     elements: list[Element]
+    _programs: dict[bool, Program | None] = field(init=False, repr=False, compare=False, default_factory=dict)
+    _targetrefs: bool = field(init=False, repr=False, compare=False)
+    _resolved: dict[tuple[str, ...], 'Pattern'] = field(init=False, repr=False, compare=False, default_factory=dict)
+    _literal: list[str] | None = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._targetrefs = any(
+            element.KIND == TARGETREF or
+            OPTIONAL <= element.KIND <= WILDCARD_REP and element.pattern._targetrefs
+            for element in self.elements
+        )
+        # Most replacements are plain phones, which as_phones can return without walking the elements
+        if all(element.KIND == GRAPHEME for element in self.elements):
+            self._literal = [element.grapheme for element in self.elements]
+        else:
+            self._literal = None
 
     @staticmethod
     def parse(string: str, categories: dict[str, cats.Category]) -> 'Pattern':
+        # The categories are kept alive alongside the pattern, so their ids can't be reused while cached
+        values = tuple(categories.values())
+        key = string, tuple(categories), tuple(map(id, values))
+        if key in _patterns:
+            return _patterns[key][0]
+        if len(_patterns) >= MAX_PATTERNS:
+            _patterns.clear()
+        pattern = Pattern._parse(string, categories)
+        _patterns[key] = pattern, values
+        return pattern
+
+    @staticmethod
+    def _parse(string: str, categories: dict[str, cats.Category]) -> 'Pattern':
         elements = []
         graphemes = categories.get('graphemes', ('*',))
         separator = categories.get('separator', '')
@@ -245,14 +731,14 @@ class Pattern:
         while index < len(string):
             char = string[index]
             if char in '([*"%<':
-                elements.extend(map(Grapheme, words.parse(_chars, graphemes, separator)))
+                elements.extend(map(get_grapheme, words.parse(_chars, graphemes, separator)))
                 _chars = ''
             if char == '(':
                 if string[index:index+2] == '()':
                     index += 2
                 else:
                     end = match_bracket(string, index)
-                    pattern = Pattern.parse(string[index+1:end], categories)
+                    pattern = Pattern._parse(string[index+1:end], categories)
                     index = end + 1
                     if string[index:index+4] == '{*?}':
                         elements.append(WildcardRepetition(pattern, greedy=False))
@@ -276,11 +762,11 @@ class Pattern:
                     end = match_bracket(string, index)
                     category = cats.Category.parse(string[index+1:end], categories)
                     index = end + 1
-                    match = re.compile('[₀₁₂₃₄₅₆₇₈₉]+').match(string, index)
+                    match = SUBSCRIPT.match(string, index)
                     if match is None:
                         subscript = None
                     else:
-                        subscript = int(match.group().translate(str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')))
+                        subscript = int(match.group().translate(FROM_SUBSCRIPT))
                         index = match.end()
                 elements.append(Category(category, subscript))
             elif char == '*':
@@ -310,7 +796,7 @@ class Pattern:
                     index += 1
                 _chars += string[index]
                 index += 1
-        elements.extend(map(Grapheme, words.parse(_chars, graphemes, separator)))
+        elements.extend(map(get_grapheme, words.parse(_chars, graphemes, separator)))
         return Pattern(elements)
 
     def __str__(self) -> str:
@@ -323,47 +809,82 @@ class Pattern:
         return bool(self.elements)
 
     def resolve(self, target: Word) -> 'Pattern':
-        _target = [Grapheme(phone) for phone in target]
-        _rtarget = reversed(_target)
+        # Patterns without target references resolve to themselves, so their compiled programs are kept
+        if not self._targetrefs:
+            return self
+        # Environments resolve against the same targets over and over, so the results (and their
+        # compiled programs) are kept, up to a limit
+        key = tuple(target)
+        if key in self._resolved:
+            return self._resolved[key]
+        if len(self._resolved) >= MAX_RESOLVED:
+            self._resolved.clear()
+
+        _target = tuple(map(get_grapheme, target))
+        _rtarget = _target[::-1]
 
         elements = []
         for element in self.elements:
-            if isinstance(element, TargetRef):
+            kind = element.KIND
+            if kind == TARGETREF:
                 elements.extend(_target if element.direction == 1 else _rtarget)
-            elif isinstance(element, Repetition):
+            elif kind == REPETITION:
                 elements.append(Repetition(element.pattern.resolve(target), element.number))
-            elif isinstance(element, WildcardRepetition):
+            elif kind == WILDCARD_REP:
                 elements.append(WildcardRepetition(element.pattern.resolve(target), element.greedy))
-            elif isinstance(element, Optional):
+            elif kind == OPTIONAL:
                 elements.append(Optional(element.pattern.resolve(target), element.greedy))
             else:
                 elements.append(element)
 
-        return Pattern(elements)
+        self._resolved[key] = Pattern(elements)
+        return self._resolved[key]
 
-    def as_phones(self, last_phone: str, catixes: dict[int, int]={}) -> list[str]:
+    def as_phones(self, last_phone: str, catixes: dict[int, int]|None=None) -> list[str]:
+        if self._literal is not None:
+            return self._literal.copy()
+        if catixes is None:
+            catixes = {}
         phones = []
         for elem in self.elements:
-            if isinstance(elem, Grapheme):
+            kind = elem.KIND
+            if kind == GRAPHEME:
                 phones.append(elem.grapheme)
-            elif isinstance(elem, Ditto):
+            elif kind == DITTO:
                 phones.append(phones[-1] if phones else last_phone)
-            elif isinstance(elem, Category):
+            elif kind == CATEGORY:
                 if elem.subscript in catixes:
                     phones.append(elem.category[catixes[elem.subscript]])
                 else:
                     raise ValueError(f'no index for category {str(elem.subscript)!r}')
-            elif isinstance(elem, Repetition):
+            elif kind == REPETITION:
                 for _ in range(elem.number):
                     phones.extend(elem.pattern.as_phones(phones[-1] if phones else last_phone, catixes))
             else:
                 raise TypeError(f'cannot convert {type(elem).__name__!r} to phones')
         return phones
 
-    def _match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[int, dict[int, int]]:
+    def compile(self, reverse: bool=False) -> Program | None:
+        if reverse not in self._programs:
+            self._programs[reverse] = Program.compile(self.elements, reverse)
+        return self._programs[reverse]
+
+    def _match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[int, dict[int, int]]:
+        if catixes is None:
+            catixes = {}
         if (start is None) == (stop is None):
             raise TypeError('exactly one of start and stop must be given.')
-        elif start is not None:
+
+        program = self.compile(reverse=start is None)
+        if program is not None:
+            pos = stop if start is None else start
+            phones = get_phones(word)
+            end, catixes = program.exec(phones, pos, catixes, program.memo())
+            if end == FAIL:
+                raise MatchFailed()
+            return abs(end - pos), catixes
+
+        if start is not None:
             iter_elements = ((element, Pattern(self.elements[i+1:])) for i, element in enumerate(self.elements))
         else:  # stop is not None
             iter_elements = ((element, Pattern(self.elements[:i])) for i, element in reversed(list(enumerate(self.elements))))
@@ -380,7 +901,7 @@ class Pattern:
 
         return length, catixes
 
-    def match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]={}) -> tuple[slice|None, dict[int, int]]:
+    def match(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> tuple[slice|None, dict[int, int]]:
         try:
             length, catixes = self._match(word, start, stop, catixes)
             if start is not None:
@@ -389,3 +910,42 @@ class Pattern:
                 return Match(stop-length, stop), catixes
         except MatchFailed:
             return None, {}
+
+    def matchall(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> list[tuple[slice, dict[int, int]]]:
+        return list(self.matchiter(word, start, stop, catixes))
+
+    def matchiter(self, word: Word, start: int|None=None, stop: int|None=None, catixes: dict[int, int]|None=None) -> Iterator[tuple[slice, dict[int, int]]]:
+        if catixes is None:
+            catixes = {}
+        indices = range(*slice(start, stop).indices(len(word)))
+        program = self.compile()
+        if program is None:
+            for index in indices:
+                match, _catixes = self.match(word, start=index, catixes=catixes)
+                if match is not None:
+                    yield match, _catixes
+            return
+
+        phones = get_phones(word)
+        if program.dfa is not None:
+            length = len(program.dfa.steps)
+            for index in program.dfa.search(phones, indices.start, indices.stop):
+                yield Match(index, index+length), catixes
+            return
+
+        # The visited states are shared between start positions, since a state that failed from one start fails from all
+        memo = program.memo()
+        # Starts too close to the end of the word to fit the shortest possible match can be skipped
+        indices = range(indices.start, min(indices.stop, len(phones) - program.minlength + 1))
+        if program.prefix:
+            indices = program.candidates(phones, indices.start, indices.stop)
+        elif program.first is not None:
+            indices = (index for index in indices if phones[index] in program.first)
+        for index in indices:
+            end, _catixes = program.exec(phones, index, catixes, memo)
+            if end != FAIL:
+                yield Match(index, end), _catixes
+
+
+# Patterns are never mutated once parsed, so rules with the same source and categories can share them
+_patterns: dict[tuple[str, tuple[str, ...], tuple[int, ...]], tuple[Pattern, tuple]] = {}
@@ -1,22 +1,22 @@
 import re
+from collections import deque
 from collections.abc import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from functools import reduce
-from itertools import repeat
-from operator import and_
+from itertools import chain, islice, repeat
 from random import randint
 from . import logger
 from .cats import Category
 from .patterns import Pattern
 from .utils import split
-from .words import Word, parse
+from .words import Word, combine_graphemes, parse
 
 ## Exceptions
 class RuleDidNotApply(Exception):
-    message = '{str(rule)!r} does not apply to {str(word)!r}'
+    message = '{rule!r} does not apply to {word!r}'
 
 class RuleRandomlySkipped(RuleDidNotApply):
-    message = '{str(self)!r} was randomly not run on {str(word)!r}'
+    message = '{rule!r} was randomly not run on {word!r}'
 
 class NoTargetsFound(RuleDidNotApply):
     pass
@@ -29,7 +29,7 @@ class BlockStopped(Exception):
 
 
 ## Classes
-@dataclass
+@dataclass(slots=True)
 class Target:
     pattern: Pattern
     indices: list[int]
@@ -56,23 +56,34 @@ class Target:
         return f'Target({str(self)!r})'
 
     def match(self, word: Word) -> list[tuple[slice, dict[int, int]]]:
-        func = lambda i: i[0] is not None and i[0] != slice(0, 0)
-        matches = list(filter(func, (self.pattern.match(word, start=start) for start in range(len(word)))))
-        if self.indices:
-            matches = [matches[ix] for ix in self.indices if -len(matches) <= ix < len(matches)]
-
-        if not matches:
-            logger.debug('>> Target not found')
-        elif self.pattern or self.indices:
-            for match, _ in matches:
-                logger.debug(f'>> Found {str(word[match])!r} at {match.start}')
+        matches = ((match, catixes) for match, catixes in self.pattern.matchiter(word) if match != slice(0, 0))
+        indices = self.indices
+        # Only as many matches as the indices can reach are kept, so the rest of the word needn't be matched
+        if not indices:
+            matches = list(matches)
         else:
-            logger.debug(f'>> Found null target at all positions in range 1..{len(word)}')
+            if min(indices) >= 0:
+                matches = list(islice(matches, max(indices) + 1))
+            elif max(indices) < 0:
+                matches = list(deque(matches, maxlen=-min(indices)))
+            else:
+                matches = list(matches)
+            matches = [matches[ix] for ix in indices if -len(matches) <= ix < len(matches)]
+
+        # Debug messages are only built when they'll be logged, as formatting them costs more than matching
+        if logger.enabled('DEBUG'):
+            if not matches:
+                logger.debug('>> Target not found')
+            elif self.pattern or self.indices:
+                for match, _ in matches:
+                    logger.debug(f'>> Found {str(word[match])!r} at {match.start}')
+            else:
+                logger.debug(f'>> Found null target at all positions in range 1..{len(word)}')
 
         return matches
 
 
-@dataclass
+@dataclass(slots=True)
 class Environment:
     @staticmethod
     def parse(string: str, categories: dict[str, Category]) -> 'Environment':
@@ -87,7 +98,7 @@ class Environment:
         return f'{self.__class__.__name__}({str(self)!r})'
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class LocalEnvironment(Environment):
     left: Pattern
     right: Pattern
@@ -100,26 +111,29 @@ class LocalEnvironment(Environment):
     def __str__(self) -> str:
         return f'{self.left}_{self.right}'
 
-    def match(self, word: Word, match: slice, catixes: dict[int, int]) -> bool:
-        target = word[match]
+    def match(self, word: Word, match: slice, catixes: dict[int, int], target: Word|None=None) -> bool:
+        if target is None:
+            target = word[match]
         lmatch, catixes = self.left.resolve(target).match(word, stop=match.start, catixes=catixes)
+        if lmatch is None:
+            return False
         rmatch, _ = self.right.resolve(target).match(word, start=match.stop, catixes=catixes)
-        return lmatch is not None and rmatch is not None
+        return rmatch is not None
 
-    def match_all(self, word: Word, match: slice, catixes: dict[int, int]) -> list[int]:
-        target = word[match]
+    def match_all(self, word: Word, match: slice, catixes: dict[int, int], target: Word|None=None) -> list[int]:
+        if target is None:
+            target = word[match]
         left = self.left.resolve(target)
         right = self.right.resolve(target)
         indices = []
         for index in range(len(word) + 1):
             lmatch, _catixes = left.match(word, stop=index, catixes=catixes)
-            rmatch, _ = right.match(word, start=index, catixes=_catixes)
-            if lmatch is not None and rmatch is not None:
+            if lmatch is not None and right.match(word, start=index, catixes=_catixes)[0] is not None:
                 indices.append(index)
         return indices
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class AdjacencyEnvironment(Environment):
     pattern: Pattern
 
@@ -131,13 +145,17 @@ class AdjacencyEnvironment(Environment):
     def __str__(self) -> str:
         return f'~{self.pattern}'
 
-    def match(self, word: Word, match: slice, catixes: dict[int, int]) -> bool:
-        pattern = self.pattern.resolve(word[match])
+    def match(self, word: Word, match: slice, catixes: dict[int, int], target: Word|None=None) -> bool:
+        if target is None:
+            target = word[match]
+        pattern = self.pattern.resolve(target)
         return (pattern.match(word, stop=match.start, catixes=catixes)[0] or
                 pattern.match(word, start=match.stop, catixes=catixes)[0])
 
-    def match_all(self, word: Word, match: slice, catixes: dict[int, int]) -> list[int]:
-        pattern = self.pattern.resolve(word[match])
+    def match_all(self, word: Word, match: slice, catixes: dict[int, int], target: Word|None=None) -> list[int]:
+        if target is None:
+            target = word[match]
+        pattern = self.pattern.resolve(target)
         indices = []
         for index in range(len(word) + 1):
             if (pattern.match(word, stop=index, catixes=catixes)[0] or
@@ -146,7 +164,7 @@ class AdjacencyEnvironment(Environment):
         return indices
 
 
-@dataclass(repr=False)
+@dataclass(repr=False, slots=True)
 class GlobalEnvironment(Environment):
     pattern: Pattern
     indices: list[int]
@@ -169,27 +187,56 @@ class GlobalEnvironment(Environment):
         else:
             return str(self.pattern)
 
-    def match(self, word: Word, match: slice, catixes: dict[int, int]) -> bool:
-        target = word[match]
+    def match(self, word: Word, match: slice, catixes: dict[int, int], target: Word|None=None) -> bool:
+        if target is None:
+            target = word[match]
         pattern = self.pattern.resolve(target)
         if not self.indices:
-            indices = range(len(word))
+            # matchiter only tries the starts that its prefilters can't rule out, and stops at the first match
+            return next(pattern.matchiter(word, catixes=catixes), None) is not None
         else:
             length = len(word)
-            indices = ((index+length) if index < 0 else index for index in self.indices)
-        return any(pattern.match(word, start=index, catixes=catixes)[0] is not None for index in indices)
+            for index in self.indices:
+                if pattern.match(word, start=(index+length) if index < 0 else index, catixes=catixes)[0] is not None:
+                    return True
+            return False
 
-    def match_all(self, word: Word, match: slice, catixes: dict[int, int]) -> list[int]:
+    def match_all(self, word: Word, match: slice, catixes: dict[int, int], target: Word|None=None) -> list[int]:
         # Ignoring self.pattern
         if not self.indices:
             return list(range(1, len(word)))
         else:
             length = len(word)
-            return list((index+length) if index < 0 else index for index in self.indices)
+            return sorted({(index+length) if index < 0 else index for index in self.indices})
+
+
+def intersect(indices1: list[int], indices2: list[int]) -> list[int]:
+    # Both lists are ascending, so they can be intersected in a single merge
+    indices = []
+    i = j = 0
+    length1, length2 = len(indices1), len(indices2)
+    while i < length1 and j < length2:
+        if indices1[i] < indices2[j]:
+            i += 1
+        elif indices1[i] > indices2[j]:
+            j += 1
+        else:
+            indices.append(indices1[i])
+            i += 1
+            j += 1
+    return indices
 
 
 def match_environments(environments: list[list[Environment]], word: Word, match: slice, catixes: dict[int, int]) -> bool:
-    return any(all(environment.match(word, match, catixes) for environment in and_environments) for and_environments in environments)
+    # The target is sliced out once and shared by every environment
+    target = word[match]
+    for and_environments in environments:
+        for environment in and_environments:
+            if not environment.match(word, match, catixes, target):
+                break
+        else:
+            return True
+    return False
 
 
 class Predicate:
@@ -244,10 +291,11 @@ class Predicate:
         return f'{self.__class__.__name__}({str(self)!r})'
 
     def match(self, word: Word, match: slice, catixes: dict[int, int]) -> bool:
-        if match_environments(self.exceptions, word, match, catixes):
+        # Unconditional predicates, the common case, skip the environment checks entirely
+        if self.exceptions and match_environments(self.exceptions, word, match, catixes):
             logger.debug('>>> Matched an exception')
             return False
-        elif match_environments(self.conditions, word, match, catixes) or not self.conditions:
+        elif not self.conditions or match_environments(self.conditions, word, match, catixes):
             logger.debug('>>> Matched a condition')
             return True
         else:
@@ -309,7 +357,9 @@ class InsertPredicate(Predicate):
         return f'{destinations}{super().__str__()}'
 
     def get_destinations(self, word: Word, match: slice, catixes: dict[int, int], index: int) -> list[int]:
-        return sorted(reduce(and_, map(lambda e: set(e.match_all(word, match, catixes)), self.destinations[index % len(self.destinations)])))
+        environments = self.destinations[index % len(self.destinations)]
+        target = word[match]
+        return reduce(intersect, (environment.match_all(word, match, catixes, target) for environment in environments))
 
     def get_changes(self, word: Word, match: slice, catixes: dict[int, int], index: int) -> list[tuple[slice, list[str]]]:
         target = list(word[match])
@@ -347,7 +397,7 @@ FLAGS = ('ignore', 'ditto', 'stop', 'rtl', 'repeat', 'persist', 'chance')
 TERNARY_FLAGS = ('ditto', 'stop')
 NUMERIC_FLAGS = ('repeat', 'persist', 'chance')
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Flags:
     ignore: int = 0
     ditto: int = 0
@@ -402,23 +452,29 @@ class Flags:
             flags.append('!stop')
         if self.rtl:
             flags.append('rtl')
-        if self.repeat != Flags.repeat:
+        if self.repeat != _FLAG_DEFAULTS['repeat']:
             flags.append(f'repeat: {self.repeat}')
-        if self.persist != Flags.persist:
+        if self.persist != _FLAG_DEFAULTS['persist']:
             flags.append(f'persist: {self.persist}')
-        if self.chance != Flags.chance:
+        if self.chance != _FLAG_DEFAULTS['chance']:
             flags.append(f'chance: {self.chance}')
         return '; '.join(flags)
 
     def __repr__(self) -> str:
         return f'Flags({str(self)!r})'
 
+# Slots replace the class attributes that held the defaults
+_FLAG_DEFAULTS = {field.name: field.default for field in fields(Flags)}
+
 
 class BaseRule:
+    __slots__ = ()
+
     def __call__(self, word: Word, nested: bool=False) -> Word:
-        if not nested:
+        if not nested and logger.enabled('INFO'):
             logger.info(f'This word: {str(word)!r}')
-            logger.debug(f'Segments: {" ".join(map(repr, word))}')
+            if logger.enabled('DEBUG'):
+                logger.debug(f'Segments: {" ".join(map(repr, word))}')
         if randint(1, 100) <= self.flags.chance:
             for _ in range(self.flags.repeat):
                 wordin = word
@@ -441,7 +497,7 @@ WS_AFTER = r'([,;:]) '
 WS_AROUND = r' (->|>>|[>/!&+\-]) '
 WS_BEFORE = r' (@)'
 
-@dataclass
+@dataclass(slots=True)
 class Rule(BaseRule):
     targets: list[Target]
     predicates: list[Predicate]
@@ -480,79 +536,111 @@ class Rule(BaseRule):
         return f'Rule({str(self)!r})'
 
     def _get_targets(self, word: Word) -> list[tuple[slice, dict[int, int], int]]:
+        debug = logger.enabled('DEBUG')
         logger.debug('Begin finding targets')
         targets = []
         for index, target in enumerate(self.targets):
-            logger.debug(f'> Searching for {str(target)!r}')
+            if debug:
+                logger.debug(f'> Searching for {str(target)!r}')
             targets.extend([(match, catixes, index) for match, catixes in target.match(word)])
         if not targets:
             logger.debug('No targets found')
             raise NoTargetsFound()
+        # Targets were added in index order and the sort is stable, so ties are already broken by index
         if self.flags.rtl:
             logger.debug('Sorting right-to-left')
-            targets.sort(key=lambda p: (-p[0].stop, p[2]))
+            targets.sort(key=lambda p: -p[0].stop)
         else:
             logger.debug('Sorting left-to-right')
-            targets.sort(key=lambda p: (p[0].start, p[2]))
-        logger.debug(f'Targets found at {", ".join([str(match.start) for match, _, _ in targets])}')
+            targets.sort(key=lambda p: p[0].start)
+        if debug:
+            logger.debug(f'Targets found at {", ".join([str(match.start) for match, _, _ in targets])}')
         return targets
 
     def _validate_targets(self, word: Word, targets: list[tuple[slice, dict[int, int], int]]) -> list[tuple[slice, dict[int, int], int, int]]:
+        debug = logger.enabled('DEBUG')
         logger.debug('Validate targets')
         validated = []
+        predicates = list(enumerate(self.predicates))
+        last = None
         for match, catixes, index in targets:
-            logger.debug(f'> Validating target at {match.start}')
-            if validated and overlaps(match, validated[-1][0]):
+            if debug:
+                logger.debug(f'> Validating target at {match.start}')
+            if last is not None and overlaps(match, last):
                 logger.debug('>> Target overlaps with last validated target')
             else:
-                for pindex, predicate in enumerate(self.predicates):
-                    logger.debug(f'>> Checking target against predicate {pindex + 1}')
+                for pindex, predicate in predicates:
+                    if debug:
+                        logger.debug(f'>> Checking target against predicate {pindex + 1}')
                     if predicate.match(word, match, catixes):
                         logger.debug('>> Target validated')
                         validated.append((match, catixes, index, pindex))
+                        last = match
                         break
                 else:
                     logger.debug('>> Target failed to validate')
         if not validated:
             logger.debug('No targets validated')
             raise NoTargetsValidated()
-        logger.debug(f'Validated targets at {", ".join([str(match.start) for match, _, _, _ in validated])}')
+        if debug:
+            logger.debug(f'Validated targets at {", ".join([str(match.start) for match, _, _, _ in validated])}')
         return validated
 
     def _get_changes(self, word: Word, targets: list[tuple[slice, dict[int, int], int, int]]) -> list[tuple[slice, list[int]]]:
+        debug = logger.enabled('DEBUG')
         logger.debug('Get changes')
         changes = []
+        predicates = self.predicates
         for match, catixes, index, pindex in targets:
-            logger.debug(f'> Getting changes for target at {match.start}')
-            _changes = changes.copy()
-            predicate = self.predicates[pindex]
+            if debug:
+                logger.debug(f'> Getting changes for target at {match.start}')
+            predicate = predicates[pindex]
+            # Only the new changes are collected, rather than copying every change so far for each target
+            _changes = []
             for change, replacement in predicate.get_changes(word, match, catixes, index):
-                if not any(overlaps(change, _change) for _change, _ in _changes):
+                if not any(overlaps(change, _change) for _change, _ in chain(changes, _changes)):
                     _changes.append((change, replacement))
-            if predicate.verify(len(changes), len(_changes)):
-                changes = _changes
+            if predicate.verify(len(changes), len(changes) + len(_changes)):
+                changes.extend(_changes)
         return changes
 
     def _apply_changes(self, word: Word, changes: list[tuple[slice, list[str]]]) -> Word:
-        logger.debug(f'Applying changes to {str(word)!r}')
-        for match, replacement in sorted(changes, key=lambda c: (-c[0].stop, -c[0].start)):
-            logger.debug(f'> Changing {str(word[match])!r} to {"".join(replacement)!r} at {match.start}')
-            word = word.replace(match, replacement)
-        return word
+        debug = logger.enabled('DEBUG')
+        if debug:
+            logger.debug(f'Applying changes to {str(word)!r}')
+        if not changes:
+            return word
+        # The new word is spliced together in one pass, rather than rebuilt for each change
+        phones = []
+        replacements = []
+        index = 0
+        for match, replacement in sorted(changes, key=lambda c: (c[0].start, c[0].stop)):
+            if debug:
+                logger.debug(f'> Changing {str(word[match])!r} to {"".join(replacement)!r} at {match.start}')
+            phones.extend(word.phones[index:match.start])
+            phones.extend(replacement)
+            replacements.append(replacement)
+            index = match.stop
+        phones.extend(word.phones[index:])
+        # Graphemes are combined in the order the changes used to be applied, right to left
+        graphemes = combine_graphemes(word.graphemes, *reversed(replacements))
+        return Word(phones, graphemes, word.separator)
 
     def _apply(self, word: Word) -> Word:
-        logger.debug(f'This rule: {str(self)!r}')
+        if logger.enabled('DEBUG'):
+            logger.debug(f'This rule: {str(self)!r}')
 
         targets = self._get_targets(word)
         validated = self._validate_targets(word, targets)
         changes = self._get_changes(word, validated)
         newword = self._apply_changes(word, changes)
 
-        logger.info(f'{str(word)!r} -> {str(self)!r} -> {str(newword)!r}')
+        if logger.enabled('INFO'):
+            logger.info(f'{str(word)!r} -> {str(self)!r} -> {str(newword)!r}')
         return newword
 
 
-@dataclass
+@dataclass(slots=True)
 class RuleBlock(BaseRule):
     name: str
     rules: list[BaseRule]
@@ -563,27 +651,26 @@ class RuleBlock(BaseRule):
 
     def _apply(self, word: Word) -> Word:
         applied = False
-        rules = []  # We use a list to store rules, since they may be applied multiple times
-        values = []  # We have a parallel list for storing the values of the 'for' flag per rule
+        persisting = []  # Pairs of a rule and how many more rules it persists for
         try:
             for cur_rule in self.rules:
                 # cur_rule runs before the persistent rules, but persists after them
-                for rule in (cur_rule, *rules):
+                for rule in (cur_rule, *[rule for rule, _ in persisting]):
                     flags = rule.flags
                     if not flags.ditto or (flags.ditto != 1) ^ applied:
                         try:
                             word = rule(word, nested=True)
                         except RuleDidNotApply as e:
-                            logger.debug(e.message.format(rule=rule, word=word))
+                            if logger.enabled('DEBUG'):
+                                logger.debug(e.message.format(rule=str(rule), word=str(word)))
                             applied = False
                         else:
                             applied = True
                         if flags.stop and (flags.stop != 1) ^ applied:
                             raise BlockStopped()
-                rules.append(cur_rule)
-                values.append(cur_rule.flags.persist)
+                persisting.append((cur_rule, cur_rule.flags.persist))
                 # Decrement all persistence values, discard any rules for which it reaches 0
-                rules, values = zip(*[(r, v-1) for r, v in zip(rules, values) if v > 1])
+                persisting = [(rule, value-1) for rule, value in persisting if value > 1]
         except BlockStopped:
             pass
         return word
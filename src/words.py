@@ -1,4 +1,5 @@
 import re
+import sys
 from collections.abc import Iterable, Iterator
 from dataclasses import dataclass
 
@@ -62,7 +63,8 @@ def parse(string: str, graphemes: tuple[str]=('*',), separator: str='') -> list[
         if graph is None:
             raise InvalidCharacter(string[0], graphemes, _string)
         else:
-            graph = string[:len(graph)]
+            # Interned phones compare by identity against the equally interned pattern graphemes
+            graph = sys.intern(string[:len(graph)])
             word.append(graph)
             string = string.removeprefix(graph).lstrip(separator)
     return word
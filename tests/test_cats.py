@@ -30,5 +30,35 @@ def test_parse_takes_elements_from_first_category_not_in_other_categories_separa
     assert cats.Category.parse('a,b,c-b,-c,', categories={}).elements == ['a']
 
 
+def test_parse_doesnt_parse_operands_once_no_elements_are_left():
+    assert cats.Category.parse(',&', categories={}).elements == []
+    assert cats.Category.parse(',-x', categories={}).elements == []
+
+
 def test_parse_combines_categories_separated_by_pipe_or_plus():
     assert cats.Category.parse('a,|b,+c,', categories={}).elements == ['a', 'b', 'c']
+
+
+# tokenize
+def test_tokenize_splits_on_loosest_operator_outside_brackets():
+    assert cats.tokenize('a,b&c|d-(e|f)') == ('|+', ['a,b&c', 'd-(e|f)'])
+    assert cats.tokenize('a,b&c-d') == ('-', ['a,b&c', 'd'])
+    assert cats.tokenize('a') == ('', ['a'])
+
+
+def test_tokenize_rejects_unbalanced_brackets():
+    with raises(ValueError):
+        cats.tokenize('a,(b')
+    with raises(ValueError):
+        cats.tokenize('a,b]')
+
+
+# Category.index
+def test_index_returns_first_index_of_item():
+    assert cats.Category(['a', 'b', 'a']).index('a') == 0
+    assert cats.Category(['a', 'b', 'a']).index('b') == 1
+
+
+def test_index_rejects_items_not_in_category():
+    with raises(ValueError):
+        cats.Category(['a', 'b']).index('c')
@@ -5,7 +5,7 @@ skip = pytest.mark.skip
 xfail = pytest.mark.xfail
 
 from dataclasses import dataclass, field, InitVar
-from SCE.src import cats
+from SCE.src import cats, patterns
 from SCE.src.patterns import *
 
 # Mocks
@@ -126,6 +126,12 @@ def test_CharacterMixin_match_returns_1_and_catixes_when_does_match():
     assert MockCharacterElement(matches=True).match(['a'], start=0, catixes={1: 2}) == (1, {1: 2})
     assert MockCharacterElement(matches=True).match(['a'], stop=1, catixes={1: 2}) == (1, {1: 2})
 
+def test_CharacterMixin_match_forward_and_backward_raise_MatchFailed_out_of_bounds():
+    with raises(MatchFailed):
+        MockCharacterElement(matches=True).match_forward(['a'], 1)
+    with raises(MatchFailed):
+        MockCharacterElement(matches=True).match_backward(['a'], 0)
+
 ## Grapheme ##
 
 def test_Grapheme_matches_same_character():
@@ -136,6 +142,10 @@ def test_Grapheme_doesnt_match_different_character():
     word = ['b']
     assert not Grapheme(grapheme='a')._match(word, 0)
 
+def test_get_grapheme_reuses_instances():
+    assert get_grapheme('a') == Grapheme('a')
+    assert get_grapheme('a') is get_grapheme('a')
+
 ## Ditto ##
 
 def test_Ditto_doesnt_match_first_character():
@@ -215,6 +225,14 @@ def test_WildcardMixin_with_greedy_False_matches_shortest_run():
     assert MockWildcardElement(greedy=False).match_pattern(pattern, word, start=0, catixes={1: 2}) == (2, {1: 2})
     assert MockWildcardElement(greedy=False).match_pattern(pattern, word, stop=4, catixes={1: 2}) == (2, {1: 2})
 
+def test_WildcardMixin_matches_long_runs_without_recursing():
+    pattern = Pattern([Grapheme('b')])
+    word = ['a']*5000
+    with raises(MatchFailed):
+        MockWildcardElement(greedy=True).match_pattern(pattern, word, start=0)
+    with raises(MatchFailed):
+        MockWildcardElement(greedy=False).match_pattern(pattern, word, start=0)
+
 # Using WildcardRepetition in these because it inherits from SubpatternMixin with no overrides
 def test_WildcardMixin_adds_catixes_from_self_match():
     subpattern = Pattern([Category(cats.Category(['a', 'b']), 1)])
@@ -376,11 +394,131 @@ def test_Optional_uses_catixes_from_self_match_in_pattern_match():
     with raises(MatchFailed):
         Optional(subpattern, greedy=True).match_pattern(pattern, word, start=0)
 
+## Program ##
+
+def test_Program_compile_returns_None_for_unsupported_elements():
+    assert Program.compile([Grapheme('a'), TargetRef(1)]) is None
+    assert Program.compile([Optional(Pattern([MockCharacterElement(True)]), True)]) is None
+
+def test_Program_exec_returns_end_position_and_catixes():
+    program = Program.compile([Grapheme('a'), Category(cats.Category(['b', 'c']), 1)])
+    assert program.exec(['a', 'c', 'a'], 0, {2: 0}) == (2, {1: 1, 2: 0})
+    assert program.exec(['a', 'c', 'a'], 1)[0] == FAIL
+
+def test_Program_exec_with_reverse_matches_leftwards_from_position():
+    program = Program.compile([Grapheme('a'), Grapheme('b')], reverse=True)
+    assert program.exec(['a', 'b', 'a'], 2) == (0, {})
+    assert program.exec(['a', 'b', 'a'], 3)[0] == FAIL
+
+def test_Program_exec_backtracks_into_wildcards():
+    program = Program.compile([Wildcard(greedy=True, extended=False), Grapheme('a')])
+    assert program.exec(['b', 'a', 'a', 'b'], 0) == (3, {})
+    program = Program.compile([Wildcard(greedy=False, extended=False), Grapheme('a')])
+    assert program.exec(['b', 'a', 'a', 'b'], 0) == (2, {})
+
+def test_Program_exec_backtracks_without_recursing():
+    program = Program.compile([Wildcard(greedy=True, extended=False), Grapheme('b')])
+    assert program.exec(['a']*5000, 0)[0] == FAIL
+
+def test_Program_exec_doesnt_repeat_empty_wildcard_repetitions_forever():
+    program = Program.compile([WildcardRepetition(Pattern([Optional(Pattern([Grapheme('a')]), True)]), False), Grapheme('b')])
+    assert program.exec(['a', 'a', 'c'], 0)[0] == FAIL
+
+def test_Program_compile_coalesces_runs_of_literal_phones():
+    elements = [Wildcard(greedy=True, extended=False), Grapheme('a'), Grapheme('b'), Grapheme('c')]
+    program = Program.compile(elements)
+    assert program.ops == bytes([WILD, SPLIT, JUMP, LIT, MATCH])
+    assert program.args[1] == 3 and program.args[3] == ['a', 'b', 'c']
+    assert program.exec(['d', 'a', 'b', 'c', 'a', 'b', 'c'], 0)[0] == 7
+    assert program.exec(['d', 'a', 'b', 'd'], 0)[0] == FAIL
+    program = Program.compile(elements, reverse=True)
+    assert program.args[0] == ['a', 'b', 'c']
+    assert program.exec(['a', 'b', 'c', 'a', 'b', 'c'], 6)[0] == 0
+
+def test_Program_exec_shares_failed_states_of_subprograms_through_memo():
+    subpattern = Pattern([Wildcard(greedy=True, extended=False), Grapheme('b')])
+    program = Program.compile([Optional(subpattern, True), Grapheme('c')])
+    memo = program.memo()
+    assert program.exec(['a', 'a', 'a'], 0, {}, memo)[0] == FAIL
+    assert any(memo[id(subpattern.compile())])
+    assert program.exec(['a', 'a', 'a'], 1, {}, memo)[0] == FAIL
+    assert Program.compile([Category(cats.Category(['a']), 1)]).memo() is None
+
+## DFA ##
+
+def test_DFA_search_returns_starts_of_all_matches_in_range():
+    dfa = DFA([(CHAR, 'a'), (CAT, frozenset(['a', 'b']))])
+    word = ['a', 'a', 'b', 'a', 'c', 'a', 'b']
+    assert dfa.search(word, 0, 7) == [0, 1, 5]
+    assert dfa.search(word, 1, 5) == [1]
+
+def test_Program_compile_builds_DFA_only_for_fixed_length_patterns():
+    assert Program.compile([Grapheme('a'), Category(cats.Category(['b']), None)]).dfa is not None
+    assert Program.compile([Grapheme('a'), Category(cats.Category(['b']), None)], reverse=True).dfa is None
+    assert Program.compile([Grapheme('a'), Category(cats.Category(['b']), 1)]).dfa is None
+    assert Program.compile([Grapheme('a'), Wildcard(greedy=True, extended=False)]).dfa is None
+    assert Program.compile([]).dfa is None
+
+def test_Program_codegen_matches_fixed_length_patterns_in_both_directions():
+    forward = Program.codegen(bytes([CHAR, CAT]), ['a', frozenset(['b', 'c'])])
+    backward = Program.codegen(bytes([CHAR, CAT]), ['a', frozenset(['b', 'c'])], reverse=True)
+    word = ['c', 'a', 'b', 'a']
+    assert forward(word, 1) == 3
+    assert forward(word, 3) == FAIL
+    assert backward(word, 2) == 0
+    assert backward(word, 4) == 2
+    assert backward(word, 3) == FAIL
+    assert backward(word, 1) == FAIL
+
+def test_Program_compile_computes_minimum_match_length():
+    subpattern = Pattern([Grapheme('a'), Wildcard(greedy=True, extended=False)])
+    assert Program.compile([
+        Grapheme('a'),
+        Repetition(subpattern, 2),
+        WildcardRepetition(subpattern, False),
+        Optional(subpattern, True),
+    ]).minlength == 7
+
+def test_Program_compile_records_leading_category_members():
+    assert Program.compile([Category(cats.Category(['a', 'b']), 1), Wildcard(greedy=True, extended=False)]).first == {'a', 'b'}
+    assert Program.compile([Category(cats.Category(['a', 'b']), None), Wildcard(greedy=True, extended=False)]).first == {'a', 'b'}
+    assert Program.compile([Grapheme('a'), Category(cats.Category(['b']), None)]).first == {'a'}
+
+def test_Program_compile_records_phones_that_can_start_a_match():
+    optional = Optional(Pattern([Grapheme('a')]), greedy=True)
+    repetition = WildcardRepetition(Pattern([Category(cats.Category(['c', 'd']), None)]), greedy=False)
+    assert Program.compile([optional, Grapheme('b'), Wildcard(greedy=True, extended=False)]).first == {'a', 'b'}
+    assert Program.compile([optional, repetition]).first == {'a', 'c', 'd'}
+    assert Program.compile([optional]).first is None
+    assert Program.compile([Wildcard(greedy=False, extended=False), Grapheme('a')]).first is None
+
+def test_Program_candidates_yields_starts_of_literal_prefix():
+    program = Program.compile([Grapheme('a'), Grapheme('b'), Wildcard(greedy=True, extended=False)])
+    assert program.prefix == ['a', 'b']
+    word = ['a', 'b', 'a', 'a', 'b', 'c', 'a']
+    assert list(program.candidates(word, 0, 7)) == [0, 3]
+    assert list(program.candidates(word, 1, 3)) == []
+
 ## Pattern ##
 def test_Pattern_is_truthy_iff_not_empty():
     assert not Pattern([])
     assert Pattern([Grapheme('a')])
 
+# Pattern.parse
+def test_Pattern_parse_reuses_patterns_with_same_string_and_categories():
+    categories = {'C': cats.Category(['b', 'c'], 'C')}
+    pattern = Pattern.parse('a[C]₁', categories)
+    assert pattern == Pattern([Grapheme('a'), Category(categories['C'], 1)])
+    assert Pattern.parse('a[C]₁', dict(categories)) is pattern
+    assert Pattern.parse('a[C]₁', {'C': cats.Category(['d'], 'C')}) is not pattern
+
+def test_Pattern_parse_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(patterns, 'MAX_PATTERNS', 2)
+    monkeypatch.setattr(patterns, '_patterns', {})
+    for string in ('a', 'b', 'c'):
+        Pattern.parse(string, {})
+    assert len(patterns._patterns) <= 2
+
 # Pattern.resolve
 def test_Pattern_resolve_replaces_percent_with_target():
     pattern = Pattern([TargetRef(1)])
@@ -390,6 +528,24 @@ def test_Pattern_resolve_replaces_left_arrow_with_reversed_target():
     pattern = Pattern([TargetRef(-1)])
     assert pattern.resolve('ab') == Pattern([Grapheme('b'), Grapheme('a')])
 
+def test_Pattern_resolve_reverses_target_for_every_left_arrow():
+    pattern = Pattern([TargetRef(-1), TargetRef(-1)])
+    assert pattern.resolve('ab') == Pattern([Grapheme('b'), Grapheme('a'), Grapheme('b'), Grapheme('a')])
+
+def test_Pattern_resolve_mixes_percent_and_left_arrow():
+    pattern = Pattern.parse('%c<%', {})
+    assert pattern.resolve('ab') == Pattern.parse('abcbaab', {})
+
+def test_Pattern_resolve_returns_pattern_without_target_references_unchanged():
+    pattern = Pattern([Grapheme('a'), Optional(Pattern([Grapheme('b')]), True)])
+    assert pattern.resolve('ab') is pattern
+
+def test_Pattern_resolve_reuses_results_for_the_same_target():
+    pattern = Pattern([Grapheme('a'), TargetRef(1)])
+    resolved = pattern.resolve(Word(['b', 'c']))
+    assert pattern.resolve(['b', 'c']) is resolved
+    assert pattern.resolve(['c']) == Pattern([Grapheme('a'), Grapheme('c')])
+
 def test_Pattern_resolve_recurses_into_Repetition_WildcardRepetition_Optional():
     pattern = Pattern([
         Repetition(Pattern([TargetRef(1)]), 3),
@@ -407,6 +563,13 @@ def test_Pattern_as_phones_converts_Grapheme_to_string():
     pattern = Pattern([Grapheme('a'), Grapheme('b'), Grapheme('c')])
     assert pattern.as_phones('') == ['a', 'b', 'c']
 
+def test_Pattern_as_phones_returns_fresh_list_for_plain_phones():
+    pattern = Pattern([Grapheme('a'), Grapheme('b')])
+    phones = pattern.as_phones('c')
+    assert phones == ['a', 'b']
+    phones.append('d')
+    assert pattern.as_phones('c') == ['a', 'b']
+
 def test_Pattern_as_phones_Ditto_copies_previous_string():
     pattern = Pattern([Grapheme('a'), Ditto()])
     assert pattern.as_phones('') == ['a', 'a']
@@ -479,3 +642,37 @@ def test_Pattern_match():
     assert pattern.match(word, stop=2, catixes={1: 2}) == (Match(0, 2), {1: 2})
     assert pattern.match(word, start=1, catixes={1: 2}) == (None, {})
     assert pattern.match(word, stop=1, catixes={1: 2}) == (None, {})
+
+def test_Pattern_match_default_catixes_are_not_shared_between_calls():
+    pattern = Pattern([Grapheme('a')])
+    _, catixes = pattern.match(['a'], start=0)
+    catixes[1] = 0
+    assert pattern.match(['a'], start=0) == (Match(0, 1), {})
+
+# Pattern.matchall
+def test_Pattern_matchall_returns_matches_at_each_start_in_range():
+    pattern = Pattern([Grapheme('a'), Wildcard(greedy=False, extended=False)])
+    word = ['a', 'b', 'a', 'a', '#']
+    assert pattern.matchall(word) == [(Match(0, 2), {}), (Match(2, 4), {})]
+    assert pattern.matchall(word, start=1, stop=3) == [(Match(2, 4), {})]
+
+def test_Pattern_matchall_doesnt_reuse_states_from_successful_matches():
+    pattern = Pattern([Wildcard(greedy=True, extended=False), Grapheme('b')])
+    word = ['a', 'a', 'b', 'a', 'b']
+    assert pattern.matchall(word) == [(Match(0, 5), {}), (Match(1, 5), {}), (Match(2, 5), {}), (Match(3, 5), {})]
+
+def test_Pattern_matchall_falls_back_to_match_for_uncompilable_patterns():
+    pattern = Pattern([MockCharacterElement(True), MockCharacterElement(True)])
+    assert pattern.matchall(['a']*3) == [(Match(0, 2), {}), (Match(1, 3), {})]
+
+def test_Pattern_matchiter_yields_matches_lazily():
+    pattern = Pattern([Grapheme('a')])
+    matches = pattern.matchiter(['a', 'b', 'a'])
+    assert next(matches) == (Match(0, 1), {})
+    assert list(matches) == [(Match(2, 3), {})]
+
+def test_Pattern_matchall_accepts_Word():
+    pattern = Pattern([Grapheme('a'), Grapheme('b')])
+    word = Word(['#', 'a', 'b', 'a', 'b', '#'])
+    assert pattern.matchall(word) == [(Match(1, 3), {}), (Match(3, 5), {})]
+    assert pattern.match(word, stop=5) == (Match(3, 5), {})
@@ -39,6 +39,10 @@ class MockPattern(Pattern):
                     return match, {}
             return None, {}
 
+    def matchiter(self, word, start=None, stop=None, catixes={}):
+        matches = (self.match(word, start=index, catixes=catixes) for index in range(*slice(start, stop).indices(len(word))))
+        return ((match, catixes) for match, catixes in matches if match is not None)
+
 @dataclass
 class MockTarget(Target):
     pattern: Pattern = field(init=False, default=Pattern([]))
@@ -100,6 +104,11 @@ def test_match_environments_returns_true_if_all_environments_in_a_group_match(wo
     assert not match_environments([[env1, env2]], word, slice(3, 5), {})
     assert match_environments([[env1, env1]], word, slice(3, 5), {})
 
+# intersect
+def test_intersect_returns_indices_in_both_lists():
+    assert intersect([1, 3, 5, 7, 9], [1, 2, 4, 5, 7, 8]) == [1, 5, 7]
+    assert intersect([], [1, 2]) == []
+
 # overlaps
 def test_two_empty_slices_overlap_when_identical():
     assert overlaps(slice(1, 1), slice(1, 1))
@@ -149,6 +158,17 @@ def test_Target_doesnt_consider_empty_match_at_0(word):
     ]
     assert Target(pattern, [0]).match(word) == [(slice(1, 2), {})]
 
+def test_Target_with_positive_indices_stops_matching_after_last_index(word):
+    pattern = MockPattern([slice(1, 2), slice(2, 3), slice(3, 4)])
+    starts = []
+    _match = pattern.match
+    def match(word, start=None, stop=None, catixes={}):
+        starts.append(start)
+        return _match(word, start=start, stop=stop, catixes=catixes)
+    pattern.match = match
+    assert Target(pattern, [1]).match(word) == [(slice(2, 3), {})]
+    assert starts == [0, 1, 2]
+
 ## LocalEnvironment ##
 def test_LocalEnvironment_matches_iff_left_and_right_match(word):
     lenv = LocalEnvironment(
@@ -202,6 +222,7 @@ def test_GlobalEnvironment_match_all_returns_all_indices_where_matching_can_happ
     assert GlobalEnvironment.parse('@2|4|5|8|9', {}).match_all(word, slice(1, 2), {}) == [
         2, 4, 5, 8, 9
     ]
+    assert GlobalEnvironment.parse('@-1|2|9', {}).match_all(word, slice(1, 2), {}) == [2, 9]
 
 ## Predicate ##
 
@@ -263,6 +284,11 @@ def test_MovePredicate_get_changes_adds_match_with_empty_replacement_to_InsertPr
         (slice(7, 7), ['a']),
     ]
 
+## Flags ##
+def test_Flags_str_omits_default_values():
+    assert str(Flags()) == ''
+    assert str(Flags(rtl=1, repeat=2, chance=50)) == 'rtl; repeat: 2; chance: 50'
+
 ## BaseRule ##
 def test_BaseRule_randomly_runs_if_chance_flag_is_set(set_random, word):
     # Sequence of randint calls is 50, 98, 54, 6, ...
@@ -361,8 +387,30 @@ def test_Rule__apply_changes_makes_all_replacements(word):
         (slice(5, 6), ['d']),
     ]) == Word(['a', 'b', 'a', 'c', 'a', 'd', 'a', 'a', 'a', 'a'])
 
+def test_Rule__apply_changes_orders_insertions_around_replacements(word):
+    assert Rule.parse('() > ()', {})._apply_changes(word, [
+        (slice(3, 3), ['c']),
+        (slice(1, 3), ['b']),
+        (slice(1, 1), ['d']),
+    ]) == Word(['a', 'd', 'b', 'c', 'a', 'a', 'a', 'a', 'a', 'a', 'a'])
+
+def test_Rule__apply_changes_returns_same_word_without_changes(word):
+    assert Rule.parse('() > ()', {})._apply_changes(word, []) is word
+
 # _apply
 
 ## RuleBlock ##
 
 # _apply
+def test_RuleBlock_applies_each_rule_in_turn():
+    block = RuleBlock('block', [MockBaseRule(Flags()), MockBaseRule(Flags())])
+    assert block._apply(Word([])) == Word(['a', 'a'])
+
+def test_RuleBlock_reapplies_persistent_rules_after_later_rules():
+    block = RuleBlock('block', [MockBaseRule(Flags(persist=2)), MockBaseRule(Flags()), MockBaseRule(Flags())])
+    assert block._apply(Word([])) == Word(['a', 'a', 'a', 'a'])
+
+def test_RuleBlock_logs_and_continues_past_rules_that_dont_apply(monkeypatch):
+    monkeypatch.setattr(logger, 'level', 'DEBUG')
+    block = RuleBlock('block', [Rule.parse('x > y', {}), MockBaseRule(Flags())])
+    assert block._apply(Word(['b'])) == Word(['b', 'a'])
@@ -44,6 +44,9 @@ def test_parse_wildcard_graphemes_match_anything():
     assert parse('abc', ('*',)) == ['a', 'b', 'c']
     assert parse('abbbcb', ('*b',)) == ['ab', 'bb', 'cb']
 
+def test_parse_interns_phones():
+    assert parse('a.bc', ('a', 'bc'), '.')[1] is parse('bca', ('a', 'bc'))[0]
+
 ## unparse ##
 
 def test_unparse_joins_word_when_only_monographs():